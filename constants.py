@@ -0,0 +1,70 @@
+# Constants shared by the query agent: the namespace queried by default, the prompt template and fields,
+# and the regular expressions used to route queries. Environment-driven settings stay in main.py,
+# since they are read after the .env file has been loaded.
+import re
+
+# Namespace whose pods and deployments are queried
+NAMESPACE_DEFAULT = "default"
+
+# System prompt for the AI assistant, Tweaking the system prompt to get the answers in a clear and concize format.
+# The cluster data is appended after it, one line per pod, deployment and node, up to {max_items} of each.
+SYSTEM_PROMPT_TEMPLATE = "You are an Ai assistant and provide assistance to only kubernetes related queries.If the user asks how many pods just give the number of pods precisely and not more than that.Analyze the following Kubernetes pods and deployments of the {namespace} namespace, and node data. In total there are {pod_count} pods, {deployment_count} deployments and {node_count} nodes, but at most {max_items} of each are listed below, so answer questions about totals from these counts:\n"
+
+# Added to the system prompt when some resources could not be fetched, so the model does not take their empty lists as real
+FETCH_FAILED_PROMPT = "The following could not be fetched from the Kubernetes API, so their counts and details are unknown: {resources}.\n"
+
+# Fields of each resource that are written into the OpenAI prompt, as (label, key) pairs.
+# Anything not listed here (labels, selectors, rollout strategy, ...) only costs prompt tokens, so it is not extracted
+# from the LIST responses; the apiserver still returns the full objects.
+PROMPT_FIELDS = {
+    "pods": (("Pod name", "name"), ("Status", "status"), ("Node", "node")),
+    "deployments": (("Name", "name"), ("Replicas", "replicas"), ("Available", "available_replicas"), ("Status", "status")),
+    "nodes": (("Name", "name"), ("Status", "status"), ("Node IP", "node_ip"), ("Unschedulable", "unschedulable"))
+}
+
+# Regular expression used to extract the pod name from log queries, compiled once at import time.
+# Matches e.g. "log for the pod nginx-1", "logs of pod nginx-1", "logs from pod nginx-1" and "log pod nginx-1".
+# The name must follow a preposition or the word "pod", so words like "say" in "what does the log say" are not taken for a pod name.
+POD_LOG_RE = re.compile(
+    r"\blogs?\b\s+(?:(?:for|of|from)\s+(?:the\s+)?(?:pod\s+)?|(?:the\s+)?pod\s+)(?!(?:for|of|from|the|pod)(?:\s|$))([a-z0-9](?:[a-z0-9.-]*[a-z0-9])?)",
+    re.IGNORECASE
+)
+
+# Regular expression recognising log queries by the whole word "log" or "logs", so words like "catalog" or "dialog" do not match
+LOG_QUERY_RE = re.compile(r"\blogs?\b", re.IGNORECASE)
+
+
+# Function returns True if the query asks for pod logs
+def is_log_query(query):
+    return LOG_QUERY_RE.search(query) is not None
+
+
+# Message returned when a log query does not name a pod
+POD_NAME_NOT_FOUND = "Pod name not found in the query."
+
+# Scopes accepted at the end of the local query patterns, e.g. "... are there in the cluster?".
+# Pods and deployments are only fetched from the default namespace, so "in the cluster" is accepted only for nodes,
+# and a cluster-wide pod or deployment query is left to OpenAI instead of being answered with the namespace count.
+NAMESPACED_QUERY_SCOPE = r"(?:default\s+namespace|namespace)"
+CLUSTER_QUERY_SCOPE = r"cluster"
+
+
+# Function builds the ending shared by the local query patterns for the given scope
+def local_query_suffix(scope):
+    return r"(?:\s+(?:are\s+there|exist|do\s+i\s+have))?(?:\s+in\s+the\s+" + scope + r")?\s*[?.!]?\s*$"
+
+
+# Function compiles the patterns matching "how many <resource>" and "list <resource> names" style queries
+def compile_local_query_patterns(resource, scope):
+    suffix = local_query_suffix(scope)
+    count_re = re.compile(r"^\s*how\s+many\s+" + resource + r"s" + suffix, re.IGNORECASE)
+    list_re = re.compile(
+        r"^\s*(?:list|show(?:\s+me)?|what\s+are)(?:\s+(?:all|the))*\s+" + resource + r"(?:s|\s+names)(?:\s+names)?" + suffix,
+        re.IGNORECASE
+    )
+    return count_re, list_re
+
+
+COUNT_PODS_RE, LIST_POD_NAMES_RE = compile_local_query_patterns("pod", NAMESPACED_QUERY_SCOPE)
+COUNT_DEPLOYMENTS_RE, LIST_DEPLOYMENT_NAMES_RE = compile_local_query_patterns("deployment", NAMESPACED_QUERY_SCOPE)
+COUNT_NODES_RE, LIST_NODE_NAMES_RE = compile_local_query_patterns("node", CLUSTER_QUERY_SCOPE)
@@ -1,144 +1,376 @@
 #IMPORTS
-import re
+# Importing orjson to parse raw LIST responses from the Kubernetes API faster than the standard json module
+import orjson
 # Importing FastAPI for building the web application and HTTPException for handling exceptions
 from fastapi import FastAPI, HTTPException
+# Importing PlainTextResponse for raw pod logs and StreamingResponse to send answers to the client while they are being generated
+from fastapi.responses import PlainTextResponse, StreamingResponse
 # Logging module for console logging to track program flow and debug information
 import logging
+import logging.handlers
+import queue
+# Importing atexit to flush pending log records when the process exits
+import atexit
+# Importing asynccontextmanager to define the application lifespan that creates and closes the API clients
+from contextlib import asynccontextmanager
 import os
 # Creating a directory for logs
 log_directory = "logs"
 os.makedirs(log_directory, exist_ok=True)
 
 # Configure logging
+# Log calls only put the record on a queue; a background thread drains it into the file and the console,
+# so request handlers running on the event loop never wait on disk or terminal writes
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(
+    log_queue,
+    logging.FileHandler(os.path.join(log_directory, "agent.log")), 
+    logging.StreamHandler()  # Log to console
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(log_directory, "agent.log")), 
-        logging.StreamHandler()  # Log to console
-    ]
+    handlers=[logging.handlers.QueueHandler(log_queue)]
 )
-logging.info("FastAPI and HTTPException imported successfully.")
+log_listener.start()
+# Stopping the listener at exit rather than on application shutdown, so records logged by the server
+# after the shutdown hooks have run, and by the Uvicorn supervisor process, are still written
+atexit.register(log_listener.stop)
 
 # Importing Pydantic's BaseModel to define data validation and serialization for request bodies
-from pydantic import BaseModel
-logging.info("Pydantic imported successfully.")
-
-# Importing OS module to interact with environment variables and the file system
-import os
-logging.info("OS module imported successfully.")
-
+from pydantic import BaseModel, ConfigDict, Field
 
-# Importing Kubernetes client and config modules to interact with Kubernetes API
-from kubernetes import client, config
-logging.info("Kubernetes client and config imported successfully.")
+# Importing the asyncio Kubernetes client and config modules to interact with Kubernetes API without blocking the event loop
+from kubernetes_asyncio import client, config
 
 # Importing asyncio module for asynchronous programming, necessary for non-blocking I/O operations
 import asyncio
-logging.info("Asyncio imported successfully.")
 
-# Importing AsyncOpenAI for making asynchronous API calls to OpenAI's API
-from openai import AsyncOpenAI
-logging.info("OpenAI AsyncOpenAI imported successfully.")
+# Importing hashlib and collections for the cache of OpenAI answers
+import hashlib
+import collections
+
+# Importing time for the monotonic clock used to expire cached Kubernetes data
+import time
+
+# Importing NamedTuple to define the compact rows holding the cluster data
+from typing import NamedTuple
+
+# Importing the constants shared by the agent: default namespace, prompt template and query patterns
+from constants import (
+    NAMESPACE_DEFAULT,
+    SYSTEM_PROMPT_TEMPLATE,
+    FETCH_FAILED_PROMPT,
+    PROMPT_FIELDS,
+    POD_LOG_RE,
+    is_log_query,
+    POD_NAME_NOT_FOUND,
+    COUNT_PODS_RE,
+    LIST_POD_NAMES_RE,
+    COUNT_DEPLOYMENTS_RE,
+    LIST_DEPLOYMENT_NAMES_RE,
+    COUNT_NODES_RE,
+    LIST_NODE_NAMES_RE
+)
+
+# Importing AsyncOpenAI for making asynchronous API calls to OpenAI's API, and the httpx client it runs on
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
 
 # Importing load_dotenv from dotenv to load environment variables from a .env file into the application
 from dotenv import load_dotenv
 # Loading the environment variables from .env file
 load_dotenv()
-logging.info("Dotenv load_dotenv imported successfully and environment variables loaded.")
 
 # Loading the OpenAI API key from environment variable
 api_key = os.getenv("OPENAI_API_KEY")
-logging.info("OpenAI API key set successfully.")
 
-# Initializing the OpenAI client
-openai_client = AsyncOpenAI(api_key=api_key)
-logging.info("OpenAI client initialized successfully.")
+# The OpenAI client is initialized on startup, so every Uvicorn worker opens its own connections
+# instead of inheriting socket state from the parent process
+openai_client = None
+
+# The Kubernetes API clients are created once on startup, after the configuration is loaded,
+# so every request reuses the same pooled connections to the apiserver
+kube_api_client = None
+CORE_V1 = None
+APPS_V1 = None
+
+# Loading the Kubernetes configuration and creating the shared API clients when the application starts
+async def init_kubernetes_clients():
+    global kube_api_client, CORE_V1, APPS_V1
+    # Initializing the Kubernetes configuration from the local kubeconfig,
+    # falling back to the service account configuration when running inside the cluster
+    try:
+        await config.load_kube_config()
+    except config.ConfigException:
+        config.load_incluster_config()
+    # The pool is sized for the concurrent pod, deployment and node fetches of many simultaneous queries
+    kube_configuration = client.Configuration.get_default_copy()
+    kube_configuration.connection_pool_maxsize = int(os.getenv("K8S_CONNECTION_POOL_MAXSIZE", "100"))
+    kube_api_client = client.ApiClient(kube_configuration)
+    CORE_V1 = client.CoreV1Api(kube_api_client)
+    APPS_V1 = client.AppsV1Api(kube_api_client)
+
+
+# Initializing the OpenAI client when the application starts
+async def init_openai_client():
+    global openai_client
+    # HTTP/2 multiplexes concurrent requests over a few TLS connections. Unless OPENAI_MAX_CONNECTIONS is set,
+    # the pool (one per worker) allows as many connections as this worker's semaphore lets requests through,
+    # so a permitted request never queues for a connection.
+    # DefaultAsyncHttpxClient keeps the OpenAI SDK's default timeouts.
+    http_client = DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", str(OPENAI_WORKER_CONCURRENCY))),
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "200")),
+            keepalive_expiry=60
+        )
+    )
+    openai_client = AsyncOpenAI(api_key=api_key, http_client=http_client)
+
+
+# Closing the connections to OpenAI when the application stops
+async def close_openai_client():
+    if openai_client is not None:
+        await openai_client.close()
+
+
+# Closing the connections to the apiserver when the application stops
+async def close_kubernetes_clients():
+    if kube_api_client is not None:
+        await kube_api_client.close()
+
+
+# Lifespan of the application, run once in every Uvicorn worker.
+# The clients are closed in the reverse order of their creation, and the Kubernetes client is closed
+# even if creating or closing the OpenAI client fails.
+@asynccontextmanager
+async def lifespan(app):
+    await init_kubernetes_clients()
+    try:
+        await init_openai_client()
+        try:
+            yield
+        finally:
+            await close_openai_client()
+    finally:
+        await close_kubernetes_clients()
 
-# Initializing the Kubernetes configuration
-config.load_kube_config()
-logging.info("Kubernetes configuration loaded successfully.")
 
 # Initializing the FastAPI application
-app = FastAPI()
-logging.info("FastAPI application initialized successfully.")
+app = FastAPI(lifespan=lifespan)
 
 
 # Defining the request model for the API using Pydantic's BaseModel
 # QueryRequest will validate incoming requests, ensuring they contain a 'query' field of type string
+# Strict mode rejects coerced input (e.g. numbers for 'query'), unknown fields are refused and instances are immutable
 class QueryRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", strict=True, frozen=True)
+
     query: str
-logging.info("QueryRequest model defined successfully.")
 
 # Defining the response model for the API using Pydantic's BaseModel
 # QueryResponse will format the response sent back to the client, containing the 'query' and 'answer' fields
 class QueryResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     query: str
     answer: str
-logging.info("QueryResponse model defined successfully.")
 
+# Maximum number of queries accepted in a single "/batch" request
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "100"))
+
+# Defining the models for the "/batch" endpoint.
+# Each query in a batch carries a client-chosen 'id' that is echoed back with its answer.
+class BatchQueryRequest(QueryRequest):
+    id: str
+
+class BatchRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", strict=True, frozen=True)
+
+    requests: list[BatchQueryRequest] = Field(max_length=BATCH_MAX_QUERIES)
+
+# A query that failed has an empty 'answer' and the reason in 'error'; 'error' is left out for successful queries
+class BatchQueryResponse(QueryResponse):
+    id: str
+    error: str | None = None
+
+class BatchResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
 
-# Function fetches information about all pods in a specified Kubernetes namespace. Returns a list of dictionaries containing pod information, or an empty list if an error occurs.
-def get_pods_info(namespace="default"):
+    responses: list[BatchQueryResponse]
+
+
+# Number of seconds a LIST result from the apiserver is reused before it is fetched again
+CACHE_TTL_SECONDS = float(os.getenv("K8S_CACHE_TTL_SECONDS", "5"))
+# Cached LIST results keyed by (resource, namespace), each stored as (fetched_at, value)
+cluster_cache = {}
+# One lock per cache key so a burst of queries waits on a single LIST call instead of issuing its own
+cluster_cache_locks = {}
+
+
+# Function returns the cached value for a resource if it is still fresh, otherwise awaits fetch(namespace) and caches the result.
+# Exceptions raised by fetch are propagated and nothing is cached, so a failed call is retried on the next query.
+async def cached_fetch(resource, namespace, fetch):
+    key = (resource, namespace)
+    lock = cluster_cache_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        entry = cluster_cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] < CACHE_TTL_SECONDS:
+            return entry[1]
+        value = await fetch(namespace)
+        cluster_cache[key] = (time.monotonic(), value)
+        return value
+
+
+# Maximum number of objects requested per LIST page; larger collections are fetched in several pages
+LIST_PAGE_SIZE = int(os.getenv("K8S_LIST_PAGE_SIZE", "500"))
+
+
+# Function raises an ApiException when a raw response is not a 2xx, releasing its connection first.
+# With _preload_content=False the client returns the response without checking its status itself.
+async def raise_for_api_status(response):
+    if 200 <= response.status < 300:
+        return
+    try:
+        body = await response.read()
+    finally:
+        response.release()
+    exception = client.ApiException(status=response.status, reason=response.reason)
+    exception.body = body.decode(errors="replace")
+    raise exception
+
+
+# Function runs a paginated LIST call and returns the raw JSON items of every page.
+# _preload_content=False skips the client's model deserialization, so only plain dicts are built from the response body.
+async def list_all_items(list_fn, **kwargs):
+    items = []
+    continue_token = None
+    while True:
+        response = await list_fn(limit=LIST_PAGE_SIZE, _continue=continue_token, _preload_content=False, **kwargs)
+        # An error status (e.g. 403, or 410 for an expired continue token) must not be read as an empty page
+        await raise_for_api_status(response)
+        body = orjson.loads(await response.read())
+        items.extend(body.get("items") or [])
+        # The apiserver returns a continue token while more pages remain
+        continue_token = (body.get("metadata") or {}).get("continue")
+        if not continue_token:
+            return items
+
+
+# Rows holding the information kept for each pod, deployment and node.
+# Tuples are much smaller than one dict per object, which matters for clusters with thousands of pods.
+# The last field is the preformatted line of the OpenAI prompt, so it is built once and cached with the row.
+class PodRow(NamedTuple):
+    name: str
+    status: str | None
+    node: str | None
+    line: str
+
+class DeploymentRow(NamedTuple):
+    name: str
+    replicas: int | None
+    available_replicas: int | None
+    status: str
+    line: str
+
+class NodeRow(NamedTuple):
+    name: str
+    status: str
+    node_ip: str
+    unschedulable: bool
+    line: str
+
+
+# Fields of PROMPT_FIELDS as (label, position in the row) pairs, resolved once here instead of for every field of every row
+PROMPT_FIELD_INDEXES = {
+    resource: tuple((label, row_type._fields.index(key)) for label, key in PROMPT_FIELDS[resource])
+    for resource, row_type in (("pods", PodRow), ("deployments", DeploymentRow), ("nodes", NodeRow))
+}
+
+
+# Function formats one resource as a line of the OpenAI prompt using the fields listed in PROMPT_FIELDS.
+# values are the row's field values in the order of its row type's fields, without the line itself.
+def format_prompt_line(resource, values):
+    return ", ".join(f"{label}: {values[index]}" for label, index in PROMPT_FIELD_INDEXES[resource])
+
+
+# Function builds a row from its values, formatting its prompt line first so the tuple is allocated once
+def make_row(row_type, resource, *values):
+    return row_type(*values, format_prompt_line(resource, values))
+
+
+# Function fetches information about all pods in a specified Kubernetes namespace. Returns a list of PodRow tuples containing pod information.
+async def fetch_pods_info(namespace):
+    # Fetching the list of pods within the specified namespace through the shared CoreV1Api client
+    pods = await list_all_items(CORE_V1.list_namespaced_pod, namespace=namespace)
+    # Initializing an empty list to hold the information of each pod
+    pod_info = []
+    # Extracting relevant information for each pod
+    for pod in pods:
+        pod_info.append(make_row(
+            PodRow,
+            "pods",
+            pod["metadata"]["name"],
+            pod.get("status", {}).get("phase"),
+            pod.get("spec", {}).get("nodeName")
+        ))
+    return pod_info
+
+
+# Function returns the (cached) pod information for a namespace, or None if an error occurs.
+async def get_pods_info(namespace=NAMESPACE_DEFAULT):
     try:
-        # Creating an instance of the Kubernetes API client to interact with the Core V1 API
-        # Reference to the CoreV1Api for pod operations
-        api_instance = client.CoreV1Api()
-        # Fetching the list of pods within the specified namespace
-        pods = api_instance.list_namespaced_pod(namespace="default")
-        # Initializing an empty list to hold the information of each pod
-        pod_info = []
-        # Extracting relevant information for each pod
-        for pod in pods.items:
-            info = {
-                "name": pod.metadata.name,
-                "namespace": pod.metadata.namespace,
-                "status": pod.status.phase,
-                "node": pod.spec.node_name,
-
-            }
-            pod_info.append(info)
-        return pod_info
+        return await cached_fetch("pods", namespace, fetch_pods_info)
    #Exception handling 
     except Exception as e:
-        print(f"Error fetching pod information: {e}")
-        return []
+        logging.error(f"Error fetching pod information: {e}")
+        return None
+
 
 # Function to fetch deployment information from a specified namespace
-def get_deployments_info(namespace="default"):
+async def fetch_deployments_info(namespace):
+    # Retrieving the list of deployments in the specified namespace through the shared AppsV1Api client
+    deployments = await list_all_items(APPS_V1.list_namespaced_deployment, namespace=namespace)
+     # Initializing a list to store deployment information
+    deployment_info = []
+    for deployment in deployments:
+        spec = deployment.get("spec", {})
+        status = deployment.get("status", {})
+        deployment_info.append(make_row(
+            DeploymentRow,
+            "deployments",
+            deployment["metadata"]["name"],
+            spec.get("replicas"),
+            status.get("availableReplicas"),
+            status["conditions"][-1]["type"] if status.get("conditions") else "Unknown"
+        ))
+    return deployment_info
+
+
+# Function returns the (cached) deployment information for a namespace, or None if an error occurs.
+async def get_deployments_info(namespace=NAMESPACE_DEFAULT):
     try:
-         # Creating an instance of the AppsV1Api to interact with Kubernetes deployments
-        apps_v1 = client.AppsV1Api()
-        # Retrieving the list of deployments in the specified namespace
-        deployments = apps_v1.list_namespaced_deployment(namespace=namespace)
-         # Initializing a list to store deployment information
-        deployment_info = []
-        for deployment in deployments.items:
-            info = {
-                "name": deployment.metadata.name,
-                "replicas": deployment.spec.replicas,
-                "available_replicas": deployment.status.available_replicas,
-                "ready_replicas": deployment.status.ready_replicas,
-                "status": deployment.status.conditions[-1].type if deployment.status.conditions else "Unknown",
-                "selector": deployment.spec.selector.match_labels if deployment.spec.selector else {},
-                "strategy": deployment.spec.strategy.type if deployment.spec.strategy else "Unknown"
-            }
-            deployment_info.append(info)
-        return deployment_info
+        return await cached_fetch("deployments", namespace, fetch_deployments_info)
     #Exception handling 
     except Exception as e:
         logging.error(f"Error fetching deployment information: {e}")
-        return []
+        return None
+
+
+# Number of most recent log lines returned for a pod, so a long-running pod does not produce an unbounded answer
+POD_LOG_TAIL_LINES = int(os.getenv("POD_LOG_TAIL_LINES", "1000"))
+# Size of the chunks in which pod logs are streamed to the client
+POD_LOG_CHUNK_SIZE = 8192
 
 
 # Function to fetch logs from a specific pod in a specified namespace
-def get_pod_logs(pod_name, namespace="default"):
+async def get_pod_logs(pod_name, namespace=NAMESPACE_DEFAULT):
     try:
-        # Creating an instance of the CoreV1Api to interact with the Kubernetes API.
-        api_instance = client.CoreV1Api()
         # Fetching the logs of the specified pod in the provided namespace.
         # This method reads the log of the pod and returns it as a string.
-        logs = api_instance.read_namespaced_pod_log(name=pod_name, namespace=namespace)
+        logs = await CORE_V1.read_namespaced_pod_log(name=pod_name, namespace=namespace, tail_lines=POD_LOG_TAIL_LINES)
         return logs
     except Exception as e:
         logging.error(f"Error fetching logs for pod {pod_name}: {e}")
@@ -146,104 +378,418 @@ def get_pod_logs(pod_name, namespace="default"):
         return ""
 
 
-# Function to provide details about each node
-def get_nodes_info():
+# Function opens the log of a pod without reading it, so the body can be streamed to the client as it arrives
+async def open_pod_log_stream(pod_name, namespace=NAMESPACE_DEFAULT):
+    return await CORE_V1.read_namespaced_pod_log(
+        name=pod_name,
+        namespace=namespace,
+        tail_lines=POD_LOG_TAIL_LINES,
+        follow=False,
+        _preload_content=False
+    )
+
+
+# Function yields the body of an opened pod log in chunks and releases the connection once it is consumed
+async def iter_pod_log_chunks(response):
+    try:
+        async for chunk in response.content.iter_chunked(POD_LOG_CHUNK_SIZE):
+            yield chunk
+    finally:
+        response.release()
+
+
+# Function to provide details about each node. Nodes are cluster-scoped, so the namespace argument is unused.
+async def fetch_nodes_info(namespace=None):
+    # Listing all nodes in the cluster through the shared CoreV1Api client
+    nodes = await list_all_items(CORE_V1.list_node)
+    
+    # Initializing an empty list to store node information
+    node_info = []
+    # Counting nodes in the cluster
+    node_count = len(nodes)
+
+    # Logging the total number of nodes in the cluster
+    logging.info(f"Total number of nodes in the cluster: {node_count}")
+
+    # Extracting relevant information for each node
+    for node in nodes:
+        status = node.get("status", {})
+        node_info.append(make_row(
+            NodeRow,
+            "nodes",
+            node["metadata"]["name"],
+            status["conditions"][-1]["type"] if status.get("conditions") else "Unknown",
+            status["addresses"][0]["address"] if status.get("addresses") else "Unknown",
+            node.get("spec", {}).get("unschedulable", False)
+        ))
+
+    # Returning node information along with the count of nodes
+    return node_info, node_count  
+
+
+# Function returns the (cached) node information along with the count of nodes, or None if an error occurs.
+async def get_nodes_info():
     try:
-        # Creating an instance of the CoreV1Api to interact with Kubernetes nodes
-        api_instance = client.CoreV1Api()
-        # Listing all nodes in the cluster
-        nodes = api_instance.list_node()
-        
-        # Initializing an empty list to store node information
-        node_info = []
-        # Counting nodes in the cluster
-        node_count = len(nodes.items)
-
-        # Logging the total number of nodes in the cluster
-        logging.info(f"Total number of nodes in the cluster: {node_count}")
-
-        # Extracting relevant information for each node
-        for node in nodes.items:
-            info = {
-                "name": node.metadata.name,
-                "status": node.status.conditions[-1].type if node.status.conditions else "Unknown",
-                "labels": node.metadata.labels,
-                "node_ip": node.status.addresses[0].address if node.status.addresses else "Unknown",
-                "unschedulable": node.spec.unschedulable if hasattr(node.spec, "unschedulable") else False
-            }
-            node_info.append(info)
-
-        # Returning node information along with the count of nodes
-        return node_info, node_count  
+        return await cached_fetch("nodes", None, fetch_nodes_info)
     except Exception as e:
         logging.error(f"Error fetching nodes information: {e}")
-        return [], 0  # Returning empty list and count 0
+        return None
+
+
+# Function joins the names of a list of resources into a single answer line
+def join_names(items):
+    return ", ".join(item.name for item in items) or "None"
+
+
+# Queries that can be answered from the cluster data alone, without calling OpenAI.
+# Each entry maps a pattern to the resource it reads and a function building the answer from the result of get_cluster_data.
+LOCAL_ANSWERS = (
+    (COUNT_PODS_RE, "pods", lambda cluster: str(len(cluster["pods"]))),
+    (LIST_POD_NAMES_RE, "pods", lambda cluster: join_names(cluster["pods"])),
+    (COUNT_DEPLOYMENTS_RE, "deployments", lambda cluster: str(len(cluster["deployments"]))),
+    (LIST_DEPLOYMENT_NAMES_RE, "deployments", lambda cluster: join_names(cluster["deployments"])),
+    (COUNT_NODES_RE, "nodes", lambda cluster: str(cluster["node_count"])),
+    (LIST_NODE_NAMES_RE, "nodes", lambda cluster: join_names(cluster["nodes"]))
+)
+
+
+# Function returns the answer to a simple query computed from the cluster data, or None if the query needs OpenAI.
+# A resource that failed to load would give a wrong count or an empty list, so that raises an error instead.
+def answer_locally(query, cluster):
+    for pattern, resource, build_answer in LOCAL_ANSWERS:
+        if pattern.search(query):
+            if resource in cluster["failed"]:
+                raise RuntimeError(f"Could not fetch {resource} from the Kubernetes API.")
+            logging.info("Answered query locally: %s", query)
+            return build_answer(cluster)
+    return None
+
+
+# Maximum number of chat completion requests allowed in flight to OpenAI at the same time, across all workers
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "250"))
+# Each worker process has its own semaphore, so the limit is split between the UVICORN_WORKERS workers
+# (exported by the entry point; a server started some other way is taken to run a single worker)
+OPENAI_WORKER_CONCURRENCY = max(1, OPENAI_MAX_CONCURRENCY // int(os.getenv("UVICORN_WORKERS", "1")))
+# Semaphore bounding this worker's concurrent OpenAI calls so bursts queue locally instead of tripping the rate limits
+openai_semaphore = asyncio.Semaphore(OPENAI_WORKER_CONCURRENCY)
+# In-flight completions keyed like the answer cache, so identical concurrent queries share one upstream call
+inflight_completions = {}
+
+# Number of seconds an OpenAI answer is reused for the same query against unchanged cluster data
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "30"))
+# Maximum number of cached answers; the least recently used one is evicted first
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+# Cached answers keyed by (normalized query, cluster digest), each stored as (cached_at, answer)
+answer_cache = collections.OrderedDict()
+
+
+# Function builds the answer cache key for a query, so repeated questions about the same cluster state share an answer
+def answer_cache_key(query, cluster):
+    return (query.strip().lower(), cluster["digest"])
+
+
+# Function returns the cached answer for a key, or None if there is none or it has expired
+def get_cached_answer(key):
+    entry = answer_cache.get(key)
+    if entry is None:
+        return None
+    if time.monotonic() - entry[0] >= ANSWER_CACHE_TTL_SECONDS:
+        del answer_cache[key]
+        return None
+    answer_cache.move_to_end(key)
+    return entry[1]
+
+
+# Function stores an answer in the cache, evicting the least recently used answers beyond ANSWER_CACHE_MAX_ENTRIES
+def cache_answer(key, answer):
+    answer_cache[key] = (time.monotonic(), answer)
+    answer_cache.move_to_end(key)
+    while len(answer_cache) > ANSWER_CACHE_MAX_ENTRIES:
+        answer_cache.popitem(last=False)
+
+
+# Function builds the messages for the OpenAI API, with a system message and the user's query
+def build_openai_messages(prompt, query):
+    return [
+        {
+            "role": "system",
+            "content": f"{prompt}"
+        },
+        {
+            "role": "user",
+            "content": f"{query}"
+        } 
+    ]
+
+
+# Function sends the prompt and the user's query to the OpenAI chat API and returns the answer text
+async def create_completion(prompt, query):
+    # Using OpenAI chat API, waiting for a free slot first
+    async with openai_semaphore:
+        openai_response = await openai_client.chat.completions.create(
+            messages=build_openai_messages(prompt, query),
+            model="gpt-4o"
+        )
+
+    # Extracting OpenAI response
+    return openai_response.choices[0].message.content
+
+
+# Function streams the OpenAI answer for a query, yielding each piece of text as soon as it is generated
+async def stream_completion(prompt, query):
+    # The slot is held until the whole answer has been streamed
+    async with openai_semaphore:
+        stream = await openai_client.chat.completions.create(
+            messages=build_openai_messages(prompt, query),
+            model="gpt-4o",
+            stream=True
+        )
+        # Closing the stream when the generator finishes or is cancelled, e.g. when the client disconnects,
+        # so the underlying HTTP response is not left open until garbage collection
+        async with stream:
+            async for chunk in stream:
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if content:
+                    yield content
+
+
+# Function runs a completion and caches its answer from inside the shared task,
+# so the answer is kept even if every caller waiting for it has disconnected
+async def complete_and_cache(key, prompt, query):
+    answer = await create_completion(prompt, query)
+    cache_answer(key, answer)
+    return answer
+
+
+# Function removes a finished completion from the in-flight table. Retrieving its exception marks it as handled,
+# so a failure whose callers have all gone is logged once here instead of as "Task exception was never retrieved".
+def finish_completion(key, task):
+    inflight_completions.pop(key, None)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Error getting the OpenAI answer: {task.exception()}")
+
+
+# Function returns the OpenAI answer for a query about the given cluster data.
+# A cached answer is returned when there is one, and an identical request already in flight is joined instead of issuing a new one.
+async def ask_openai(cluster, query):
+    key = answer_cache_key(query, cluster)
+    cached = get_cached_answer(key)
+    if cached is not None:
+        logging.info("Answer served from cache for query: %s", query)
+        return cached
+
+    task = inflight_completions.get(key)
+    if task is None:
+        task = asyncio.create_task(complete_and_cache(key, cluster["prompt"], query))
+        inflight_completions[key] = task
+        task.add_done_callback(lambda done: finish_completion(key, done))
+    # Shielding the shared task so one cancelled caller does not cancel the call for the others
+    return await asyncio.shield(task)
+
+
+# Maximum number of pods, deployments and nodes listed individually in the OpenAI prompt
+PROMPT_MAX_ITEMS = int(os.getenv("PROMPT_MAX_ITEMS", "50"))
+
+
+# Function fetches pods, deployments and nodes for a namespace and builds the system prompt describing them
+async def get_cluster_data(namespace=NAMESPACE_DEFAULT):
+    # Fetching information from the functions get_pods_info, get_deployments_info, and get_nodes_info
+    # The three calls are independent, so they run concurrently and the wait is bounded by the slowest one
+    pod_data, deployment_data, node_result = await asyncio.gather(
+        get_pods_info(namespace=namespace),
+        get_deployments_info(namespace=namespace),
+        get_nodes_info()
+    )
+
+    # Recording which resources failed to load, so their empty data is never reported as the real state
+    failed = [
+        resource for resource, result in (("pods", pod_data), ("deployments", deployment_data), ("nodes", node_result))
+        if result is None
+    ]
+    pod_data = pod_data or []
+    deployment_data = deployment_data or []
+    node_data, node_count = node_result or ([], 0)
+
+    # Constructing a prompt for the AI assistant from the system prompt and the cached prompt lines.
+    # Only the first PROMPT_MAX_ITEMS of each resource are listed, so the prompt size does not grow with the cluster;
+    # the totals are stated in the system prompt instead.
+    prompt = SYSTEM_PROMPT_TEMPLATE.format(
+        namespace=namespace,
+        pod_count=len(pod_data),
+        deployment_count=len(deployment_data),
+        node_count=node_count,
+        max_items=PROMPT_MAX_ITEMS
+    ) + (FETCH_FAILED_PROMPT.format(resources=", ".join(failed)) if failed else "") + "\n".join(
+        # Each section is separated by a newline so the last line of one does not run into the next
+        "\n".join(item.line for item in section[:PROMPT_MAX_ITEMS]) for section in (pod_data, deployment_data, node_data)
+    )
+
+    return {
+        "pods": pod_data,
+        "deployments": deployment_data,
+        "nodes": node_data,
+        "node_count": node_count,
+        "failed": failed,
+        "prompt": prompt,
+        # Digest of the cluster state described by the prompt, used to key cached answers; blake2b is cheap on large inputs
+        "digest": hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+    }
+
+
+# Function extracts the pod name from a log query, or returns None if the query does not name a pod
+def extract_pod_name(query):
+    # Using regular expression to extract pod name
+    match = POD_LOG_RE.search(query)
+    if match:
+        # Extracting the pod name from the matched group
+        pod_name = match.group(1).strip()  
+        logging.info("Extracted pod name: %s", pod_name)
+        return pod_name
+    logging.error("Pod name not found in query: %s", query)
+    return None
+
+
+# Function answers a query asking for the logs of a pod
+async def answer_log_query(query, namespace=NAMESPACE_DEFAULT):
+    pod_name = extract_pod_name(query)
+    if pod_name is None:
+        return POD_NAME_NOT_FOUND
+    # Fetching logs for the specified pod
+    return await get_pod_logs(pod_name, namespace=namespace)
+
+
+# Function answers a log query with the pod log streamed as plain text.
+# Logs can be megabytes, so they are not buffered or wrapped in a QueryResponse.
+async def stream_log_query(query, namespace=NAMESPACE_DEFAULT):
+    pod_name = extract_pod_name(query)
+    if pod_name is None:
+        return PlainTextResponse(POD_NAME_NOT_FOUND)
+    try:
+        response = await open_pod_log_stream(pod_name, namespace=namespace)
+        # A missing pod or an RBAC denial comes back as a Status body, which must not be streamed as the log
+        await raise_for_api_status(response)
+    except Exception as e:
+        logging.error(f"Error fetching logs for pod {pod_name}: {e}")
+        # Returning an empty body if an error occurs, as for the buffered log answer
+        return PlainTextResponse("")
+    return StreamingResponse(iter_pod_log_chunks(response), media_type="text/plain")
+
+
+# Function answers a single query. cluster is the result of get_cluster_data and is fetched on demand when not supplied.
+async def answer_query(query, cluster=None):
+    # Determining if the query is for pod logs
+    if is_log_query(query):
+        return await answer_log_query(query, namespace=NAMESPACE_DEFAULT)
+
+    if cluster is None:
+        cluster = await get_cluster_data(namespace=NAMESPACE_DEFAULT)
+
+    # Skipping OpenAI entirely for queries the cluster data answers directly
+    local_answer = answer_locally(query, cluster)
+    if local_answer is not None:
+        return local_answer
+
+    # Asking OpenAI and preparing the answer
+    enhanced_answer = await ask_openai(cluster, query)
+    logging.info("OpenAI response received successfully.")
+    return enhanced_answer
 
 
 # Defining a POST endpoint at the "/query" route, specifying that it returns a QueryResponse model
-@app.post("/query", response_model=QueryResponse)
+@app.post("/query", response_model=QueryResponse, response_model_exclude_unset=True)
 async def query_kubernetes(request: QueryRequest):
     # Logging the received query to track incoming requests for debugging and analytics
     logging.info("Received query: %s", request.query)
     try:
-        # Determining if the query is for pod logs
-        if "log" in request.query.lower():
-            # Using regular expression to extract pod name
-            match = re.search(r"log for the pod (.+?) in the default namespace", request.query, re.IGNORECASE)
-            if match:
-                # Extracting the pod name from the matched group
-                pod_name = match.group(1).strip()  
-                logging.info("Extracted pod name: %s", pod_name)
-                # Fetching logs for the specified pod
-                logs = get_pod_logs(pod_name, namespace="default")
-                return QueryResponse(query=request.query, answer=logs)
-            else:
-                logging.error("Pod name not found in query: %s", request.query)
-                return QueryResponse(query=request.query, answer="Pod name not found in the query.")
-
-        # Fetching information from the functions get_pods_info, get_deployments_info, and get_nodes_info
-        pod_data = get_pods_info(namespace="default")
-        deployment_data = get_deployments_info(namespace="default")
-        node_data, node_count = get_nodes_info()
-
-        # Constructing a prompt for the AI assistant, Tweaking the system prompt to get the answers in a clear and concize format.
-        prompt = "You are an Ai assistant and provide assistance to only kubernetes related queries.If the user asks how many pods just give the number of pods precisely and not more than that.Analyze the following Kubernetes pods, deployment and node data:\n" + "\n".join(
-        [f"Pod name: {pod['name']}, Namespace: {pod['namespace']}, Status: {pod['status']}, Node: {pod['node']}" for pod in pod_data]
-    ) + "\n".join(
-        [f"Name: {deployment['name']}, Replicas: {deployment['replicas']}, Available: {deployment['available_replicas']}, Status: {deployment['status']}" for deployment in deployment_data]
-     ) + "\n".join(
-                [f"Name: {node['name']}, Status: {node['status']}, Node IP: {node['node_ip']}, Unschedulable: {node['unschedulable']}" for node in node_data]
-            )
-
-
-
-        # The messages for the OpenAI API, with a system message and the user's query
-        openai_message = [
-            {
-                "role": "system",
-                "content": f"{prompt}"
-            },
-            {
-                "role": "user",
-                "content": f"{request.query}"
-            } 
-        ]
-
-        # Using OpenAI chat API
-        openai_response = await openai_client.chat.completions.create(
-            messages=openai_message,
-            model="gpt-4o"
-        )
+        # Log queries are answered with the raw pod log as plain text instead of a QueryResponse
+        if is_log_query(request.query):
+            return await stream_log_query(request.query, namespace=NAMESPACE_DEFAULT)
 
-        # Extracting OpenAI response and preparing the answer
-        enhanced_answer = openai_response.choices[0].message.content
-        logging.info("OpenAI response received successfully.")
-        return QueryResponse(query=request.query, answer=enhanced_answer)
+        answer = await answer_query(request.query)
+        return QueryResponse(query=request.query, answer=answer)
     
     except Exception as e:
         # Logging any errors that occur during the process for troubleshooting
         logging.error("An error occurred: %s", e, exc_info=True)  # Log the error
         raise HTTPException(status_code=500, detail=str(e))
+
+
+# Function formats text as one Server-Sent Events message; each line of the text becomes its own 'data:' field
+def format_sse(text, event=None):
+    message = "".join(f"data: {line}\n" for line in text.split("\n"))
+    if event:
+        message = f"event: {event}\n" + message
+    return message + "\n"
+
+
+# Function yields the answer to a query as Server-Sent Events
+async def stream_answer(query):
+    try:
+        # Log queries are answered in one piece, there is nothing to generate
+        if is_log_query(query):
+            yield format_sse(await answer_log_query(query, namespace=NAMESPACE_DEFAULT))
+            return
+
+        cluster = await get_cluster_data(namespace=NAMESPACE_DEFAULT)
+        local_answer = answer_locally(query, cluster)
+        if local_answer is not None:
+            yield format_sse(local_answer)
+            return
+
+        key = answer_cache_key(query, cluster)
+        cached = get_cached_answer(key)
+        if cached is not None:
+            logging.info("Answer served from cache for query: %s", query)
+            yield format_sse(cached)
+            return
+
+        # Collecting the streamed pieces so the complete answer can be cached
+        pieces = []
+        async for text in stream_completion(cluster["prompt"], query):
+            pieces.append(text)
+            yield format_sse(text)
+        cache_answer(key, "".join(pieces))
+        logging.info("OpenAI response streamed successfully.")
+
+    except Exception as e:
+        # The response status has already been sent, so the error is reported as a final event
+        logging.error("An error occurred: %s", e, exc_info=True)  # Log the error
+        yield format_sse(str(e), event="error")
+
+
+# Defining a POST endpoint at the "/query/stream" route that streams the answer while OpenAI generates it
+@app.post("/query/stream")
+async def stream_query_kubernetes(request: QueryRequest):
+    # Logging the received query to track incoming requests for debugging and analytics
+    logging.info("Received streaming query: %s", request.query)
+    return StreamingResponse(stream_answer(request.query), media_type="text/event-stream")
+
+
+# Defining a POST endpoint at the "/batch" route to answer several queries in one round-trip
+@app.post("/batch", response_model=BatchResponse, response_model_exclude_unset=True)
+async def batch_query_kubernetes(request: BatchRequest):
+    logging.info("Received batch of %d queries", len(request.requests))
+    try:
+        # Fetching the cluster data once and sharing it between all queries of the batch
+        cluster = await get_cluster_data(namespace=NAMESPACE_DEFAULT)
+        # A failure in one query (e.g. an OpenAI rate limit) is reported on that query instead of failing the batch
+        answers = await asyncio.gather(
+            *(answer_query(item.query, cluster) for item in request.requests),
+            return_exceptions=True
+        )
+        responses = []
+        for item, answer in zip(request.requests, answers):
+            if isinstance(answer, Exception):
+                logging.error("An error occurred for batch query %s: %s", item.id, answer, exc_info=answer)
+                responses.append(BatchQueryResponse(id=item.id, query=item.query, answer="", error=str(answer)))
+            else:
+                responses.append(BatchQueryResponse(id=item.id, query=item.query, answer=answer))
+        return BatchResponse(responses=responses)
+
+    except Exception as e:
+        # Logging any errors that occur during the process for troubleshooting
+        logging.error("An error occurred: %s", e, exc_info=True)  # Log the error
+        raise HTTPException(status_code=500, detail=str(e))
     
 
 
@@ -252,6 +798,14 @@ async def query_kubernetes(request: QueryRequest):
 if __name__ == "__main__":
     # Importing the Uvicorn ASGI server to run the FastAPI application
     import uvicorn
-    logging.info("Starting FastAPI server on port 8000...")
+    # One worker process per CPU core unless UVICORN_WORKERS says otherwise
+    workers = int(os.getenv("UVICORN_WORKERS", os.cpu_count() or 1))
+    # Exporting the worker count so each worker imports main with the same value and takes its share of OPENAI_MAX_CONCURRENCY
+    os.environ["UVICORN_WORKERS"] = str(workers)
+    logging.info("Starting FastAPI server on port 8000 with %d workers...", workers)
     # Running the FastAPI application using Uvicorn, making it accessible on all interfaces (0.0.0.0) at port 8000
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # The app is passed as an import string so each worker imports it itself; uvloop and httptools
+    # replace the default asyncio event loop and HTTP parser with their C implementations.
+    # log_config=None leaves Uvicorn's loggers without handlers of their own, so server and access logs
+    # propagate to the root logger and go through the same queue instead of writing to the console on the event loop
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, loop="uvloop", http="httptools", workers=workers, log_config=None)